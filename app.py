@@ -1,16 +1,41 @@
 # Crypto Research Bot with OpenAI API
 # Requirements: pip install flask openai python-dotenv requests flask-cors gunicorn
 
+import hashlib
 import os
-from flask import Flask, request, jsonify, render_template
+import random
+import re
+from flask import Flask, request, jsonify
 from flask_cors import CORS
 from openai import OpenAI
 from dotenv import load_dotenv
+import httpx
 import json
+import queue
 import requests
-from datetime import datetime
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 
+from chart_service import ChartService
+from config import (
+    CRYPTO_GREETING_RESPONSES,
+    CRYPTO_KEYWORD_RE,
+    CRYPTO_SCOPE_RE,
+    GREETING_RE,
+    OOS_RESPONSE,
+    now_iso,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Load environment variables
 load_dotenv()
 
@@ -21,10 +46,34 @@ CORS(app)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Initialize OpenAI client with an explicit pooled transport so the many
+# threads sharing it (workers, batcher, streaming) reuse warm keep-alive
+# connections instead of the SDK's default per-client limits.
+client = OpenAI(
+    api_key=os.getenv('OPENAI_API_KEY'),
+    http_client=httpx.Client(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=httpx.Timeout(120.0, connect=10.0)
+    )
+)
+
+OPENAI_MODEL = "gpt-4-turbo-preview"  # Latest GPT-4 Turbo model
 
-# Crypto-focused system prompt with latest knowledge
+def json_response(payload, status=200):
+    """Serialize a response with orjson when available (~5-10x faster than
+    jsonify on large payloads like the CoinGecko market dump)"""
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload).encode()
+    return app.response_class(body, status=status, mimetype='application/json')
+
+# Crypto-focused system prompt with latest knowledge.
+# Kept as a static module-level constant (no timestamps, f-strings, or
+# per-session values) and sized past OpenAI's 1024-token prompt-cache
+# threshold, so the system prefix is byte-identical across calls and
+# eligible for vendor-side prompt caching. Volatile data (live market
+# numbers) is appended to the final user message instead.
 CRYPTO_SYSTEM_PROMPT = """You are CryptoBot, an advanced cryptocurrency research assistant powered by GPT-4 Turbo. You specialize in:
 
 CRYPTOCURRENCY KNOWLEDGE:
@@ -61,15 +110,265 @@ MARKET DATA:
 - Fear & Greed Index interpretation
 - Macro economic impacts
 
+ANALYSIS METHODOLOGY:
+- Distinguish clearly between established facts, widely-held interpretations, and your own speculation
+- When discussing price movements, reference the relevant timeframe (intraday, weekly, monthly, cycle-level)
+- Compare assets on like-for-like metrics: market cap vs market cap, fully-diluted vs fully-diluted
+- Treat on-chain metrics (active addresses, exchange flows, realized cap) as supporting evidence, not proof
+- Note when historical patterns (halving cycles, seasonality) have limited sample sizes
+- For DeFi protocols, consider TVL trends, audit history, token emission schedules, and admin-key risk
+- For new tokens, examine supply distribution, vesting cliffs, and insider allocations before fundamentals
+
+RESPONSE STYLE:
+- Lead with the direct answer, then provide supporting context
+- Use concrete numbers with their source context rather than vague qualifiers
+- Break complex topics into digestible sections with clear structure
+- Define jargon on first use when the question suggests a beginner audience
+- Match response depth to question complexity: simple questions get concise answers
+- When live market data is provided in the message, incorporate it and state that it is current
+- If data is unavailable or a question exceeds your knowledge cutoff, say so explicitly
+
+DATA INTERPRETATION:
+- 24h volume figures from aggregators can include wash trading on unregulated venues; prefer trusted-exchange volume when judging liquidity
+- Market-cap dominance shifts are more informative over weeks than hours
+- Funding rates and open interest indicate positioning, not direction; extreme readings often precede reversals in either direction
+- Stablecoin supply growth is a useful proxy for capital waiting on the sidelines
+- Distinguish circulating supply from total and max supply when computing valuations
+- Fear & Greed readings are contrarian indicators at extremes but noise in the middle of the range
+- Exchange reserve changes can reflect custody migrations rather than buying or selling pressure
+- Treat round-number price levels as psychological references, not technical guarantees
+- When comparing historical drawdowns, adjust for the market's much smaller size in earlier cycles
+- Cite the approximate date or era for any statistic that changes over time
+
+RISK AND COMPLIANCE:
+- Never present price predictions as certainties; frame them as scenarios with assumptions
+- Always include a brief risk warning when discussing investment decisions, leverage, or derivatives
+- Remind users that cryptocurrency markets are volatile and that they should do their own research
+- Do not provide tax or legal advice; suggest consulting a qualified professional for jurisdiction-specific questions
+- Flag common scam patterns (guaranteed returns, unsolicited offers, fake airdrops) when relevant
+
 Provide accurate, up-to-date, and actionable insights. Always include risk warnings for investment advice. Use current data when possible and be specific about timeframes and market conditions. Keep responses informative yet accessible to both beginners and advanced users."""
 
+# Shared immutable system message — one object reused by every request
+# instead of a fresh dict per call. The OpenAI client only serializes it,
+# so sharing is safe.
+SYSTEM_MESSAGE = {"role": "system", "content": CRYPTO_SYSTEM_PROMPT}
+
+def is_simple_greeting(message):
+    """Check if a message is just a greeting (no model call needed)"""
+    return bool(GREETING_RE.match(message.strip()))
+
+def mentions_crypto(message):
+    """Check if a message references crypto/market terms in one pass"""
+    return CRYPTO_KEYWORD_RE.search(message.lower()) is not None
+
+# Message routing: trivial and out-of-scope messages are answered locally,
+# short standalone questions go to the cheaper model, everything else gets
+# the full GPT-4 Turbo treatment.
+MSG_TRIVIAL = 'trivial'
+MSG_OOS = 'out_of_scope'
+MSG_COMPLEX = 'complex'
+
+MAX_MESSAGE_CHARS = 4000
+FAST_MODEL = "gpt-4o-mini"
+FAST_PATH_TOKEN_BUDGET = 50  # ~4 chars/token heuristic
+
+def classify_message(message):
+    """Cheap routing ahead of the model call.
+
+    Only short messages with no crypto vocabulary at all are treated as
+    out-of-scope; anything ambiguous goes to the model.
+    """
+    if is_simple_greeting(message):
+        return MSG_TRIVIAL
+    if len(message) < 120 and CRYPTO_SCOPE_RE.search(message.lower()) is None:
+        return MSG_OOS
+    return MSG_COMPLEX
+
+# Shared chart service instance so its connection pool persists across requests
+chart_service = ChartService()
+
 # CoinGecko API for live data (free tier)
 COINGECKO_API_BASE = "https://api.coingecko.com/api/v3"
 
+# Shared session so CoinGecko calls reuse keep-alive connections instead of
+# paying a fresh TCP+TLS handshake per request. Retries cover transient
+# rate-limit and gateway errors with exponential backoff.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[429, 502, 503, 504]
+    )
+))
+SESSION.headers.update({"Accept-Encoding": "gzip"})
+
+# Small pool for overlapping market-data fetches with prompt assembly on the
+# chat path, so a CoinGecko cache miss doesn't serialize with the OpenAI call.
+MARKET_FETCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="market-fetch")
+
+class BatchScheduler:
+    """Coalesces near-simultaneous chat completions into one OpenAI request.
+
+    History-free questions arriving within the batching window share a single
+    JSON-mode completion, amortizing the system prompt tokens and the
+    per-request round-trip under bursty traffic. Falls back to individual
+    completions if the batched reply can't be parsed.
+    """
+
+    def __init__(self, window=0.2, max_batch=8):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def submit(self, message):
+        """Queue a question; returns a Future resolving to the answer text"""
+        if not self._started:
+            with self._start_lock:
+                if not self._started:
+                    threading.Thread(target=self._run, daemon=True,
+                                     name="openai-batcher").start()
+                    self._started = True
+        future = Future()
+        self._queue.put((message, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        if len(batch) > 1:
+            try:
+                answers = self._complete_batch([msg for msg, _ in batch])
+                if answers is not None and len(answers) == len(batch):
+                    for (_, future), answer in zip(batch, answers):
+                        future.set_result(answer)
+                    return
+                logger.warning("Batched reply had %s answers for %s questions, retrying individually",
+                               len(answers) if answers else 0, len(batch))
+            except Exception as e:
+                logger.error(f"Batched completion failed, retrying individually: {str(e)}")
+
+        # Single request, or fallback after a failed batch
+        for message, future in batch:
+            try:
+                future.set_result(self._complete_single(message))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _complete_single(self, message):
+        response = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[
+                SYSTEM_MESSAGE,
+                {"role": "user", "content": message}
+            ],
+            max_tokens=1500,
+            temperature=0.7,
+            presence_penalty=0.1,
+            frequency_penalty=0.1
+        )
+        return response.choices[0].message.content
+
+    def _complete_batch(self, questions):
+        numbered = "\n\n".join(f"Q{i + 1}: {q}" for i, q in enumerate(questions))
+        prompt = (
+            f"Answer each of the following {len(questions)} independent user questions. "
+            'Reply with a JSON object of the form {"answers": ["answer to Q1", "answer to Q2", ...]} '
+            "containing exactly one complete answer per question, in order.\n\n"
+            + numbered
+        )
+        response = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[
+                SYSTEM_MESSAGE,
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=min(1500 * len(questions), 4096),
+            temperature=0.7,
+            response_format={"type": "json_object"}
+        )
+        answers = json.loads(response.choices[0].message.content).get('answers')
+        return answers if isinstance(answers, list) else None
+
+BATCHER = BatchScheduler()
+
+# In-process TTL cache for CoinGecko responses. Live market data only needs
+# ~minute freshness, so serving repeats from memory keeps the chat path off
+# the network and protects the free-tier rate limit.
+COINGECKO_CACHE_TTL = 60  # seconds
+COINGECKO_CACHE_MAX_ENTRIES = 256
+
+_coingecko_cache = {}
+_coingecko_cache_lock = threading.RLock()
+
+def fetch_coingecko(path, params=None, ttl=COINGECKO_CACHE_TTL):
+    """Fetch a CoinGecko endpoint, serving repeats from a TTL cache.
+
+    Cache entries are keyed by path + sorted params so every caller hitting
+    the same endpoint within the TTL shares one upstream request. Expired
+    entries are revalidated with a conditional GET: on a 304 the stored body
+    is reused and its TTL bumped, skipping the body download entirely.
+    """
+    key = (path, tuple(sorted(params.items())) if params else None)
+    now = time.time()
+
+    with _coingecko_cache_lock:
+        entry = _coingecko_cache.get(key)
+        if entry and now - entry[0] < ttl:
+            return entry[1]
+
+    # Revalidate an expired entry instead of re-downloading the full body
+    headers = {}
+    if entry:
+        if entry[2]:
+            headers['If-None-Match'] = entry[2]
+        if entry[3]:
+            headers['If-Modified-Since'] = entry[3]
+
+    url = f"{COINGECKO_API_BASE}{path}"
+    response = SESSION.get(url, params=params, headers=headers or None, timeout=5)
+
+    if response.status_code == 304 and entry:
+        data, etag, last_modified = entry[1], entry[2], entry[3]
+    else:
+        data = response.json()
+        if not response.ok:
+            # Never cache error bodies (404 unknown coin, 4xx/5xx that slip
+            # past the Retry forcelist) — callers treat them transiently,
+            # and a stored ETag would keep revalidating the failure
+            return data
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+
+    with _coingecko_cache_lock:
+        if key not in _coingecko_cache and len(_coingecko_cache) >= COINGECKO_CACHE_MAX_ENTRIES:
+            # Drop the stalest entry to bound memory
+            oldest = min(_coingecko_cache, key=lambda k: _coingecko_cache[k][0])
+            del _coingecko_cache[oldest]
+        _coingecko_cache[key] = (now, data, etag, last_modified)
+
+    return data
+
 def get_crypto_data(crypto_id="bitcoin"):
     """Fetch live crypto data from CoinGecko API"""
     try:
-        url = f"{COINGECKO_API_BASE}/simple/price"
         params = {
             "ids": crypto_id,
             "vs_currencies": "usd",
@@ -77,8 +376,7 @@ def get_crypto_data(crypto_id="bitcoin"):
             "include_24hr_vol": "true",
             "include_24hr_change": "true"
         }
-        response = requests.get(url, params=params, timeout=5)
-        return response.json()
+        return fetch_coingecko("/simple/price", params)
     except Exception as e:
         logger.error(f"Error fetching crypto data: {str(e)}")
         return None
@@ -86,16 +384,223 @@ def get_crypto_data(crypto_id="bitcoin"):
 def get_market_overview():
     """Get overall crypto market data"""
     try:
-        url = f"{COINGECKO_API_BASE}/global"
-        response = requests.get(url, timeout=5)
-        return response.json()
+        return fetch_coingecko("/global")
     except Exception as e:
         logger.error(f"Error fetching market data: {str(e)}")
         return None
 
+# Background-refreshed market snapshot: a daemon thread re-fetches the
+# global overview every 30s so the chat path reads it with zero network
+# I/O even when the TTL cache has expired.
+MARKET_REFRESH_INTERVAL = 30  # seconds
+MARKET_SNAPSHOT = {'data': None, 'suffix': '', 'ts': 0.0}
+
+_market_refresher_started = False
+_market_refresher_lock = threading.Lock()
+
+def _format_market_suffix(market_data):
+    """Format the live-data suffix appended to crypto-tagged messages"""
+    overview = market_data.get('data', {})
+    total_cap = overview.get('total_market_cap', {}).get('usd', 0)
+    total_vol = overview.get('total_volume', {}).get('usd', 0)
+    return f"\n\nLive Market Data: Total Market Cap: ${total_cap:,.0f}, 24h Vol: ${total_vol:,.0f}"
+
+def _market_refresher():
+    while True:
+        data = get_market_overview()
+        if data:
+            # Format once per refresh so the request path does a single
+            # string concatenation instead of dict traversal + number
+            # formatting per message
+            MARKET_SNAPSHOT.update({
+                'data': data,
+                'suffix': _format_market_suffix(data),
+                'ts': time.time()
+            })
+        time.sleep(MARKET_REFRESH_INTERVAL)
+
+def start_market_refresher():
+    """Start the snapshot refresher thread (idempotent, one per process)"""
+    global _market_refresher_started
+    with _market_refresher_lock:
+        if not _market_refresher_started:
+            threading.Thread(target=_market_refresher, daemon=True,
+                             name="market-refresher").start()
+            _market_refresher_started = True
+
+# Server-side conversation history: one bounded deque per session id, so
+# trimming is free (maxlen evicts) and the request path just extends the
+# message list from already-well-formed entries instead of slicing and
+# rebuilding dicts per request.
+MAX_HISTORY_MESSAGES = 10
+MAX_SESSIONS = 10000
+
+SESSIONS = {}
+_sessions_lock = threading.Lock()
+
+def get_session_history(session_id):
+    """Return the bounded history deque for a session, creating it if needed"""
+    with _sessions_lock:
+        history = SESSIONS.get(session_id)
+        if history is None:
+            if len(SESSIONS) >= MAX_SESSIONS:
+                # Evict the longest-idle session (dicts keep insertion order)
+                SESSIONS.pop(next(iter(SESSIONS)))
+            history = SESSIONS[session_id] = deque(maxlen=MAX_HISTORY_MESSAGES)
+    return history
+
+# Repeated FAQs ("what is bitcoin?") skip OpenAI entirely: answers are
+# cached for 10 minutes keyed by the normalized question, plus a
+# fingerprint of the previous exchange when there is history so follow-ups
+# in different conversations don't collide.
+RESPONSE_CACHE_TTL = 600  # seconds
+RESPONSE_CACHE_MAX_ENTRIES = 2048
+
+_response_cache = {}
+_response_cache_lock = threading.Lock()
+
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def normalize_question(message):
+    """Lowercase, strip punctuation, and collapse whitespace for cache keys"""
+    return _WHITESPACE_RE.sub(' ', _PUNCT_RE.sub('', message.lower())).strip()
+
+def response_cache_get(key):
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+        if entry and time.time() - entry[0] < RESPONSE_CACHE_TTL:
+            return entry[1]
+    return None
+
+def response_cache_put(key, response_text):
+    with _response_cache_lock:
+        if key not in _response_cache and len(_response_cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+            oldest = min(_response_cache, key=lambda k: _response_cache[k][0])
+            del _response_cache[oldest]
+        _response_cache[key] = (time.time(), response_text)
+
+def build_chat_messages(user_message, history):
+    """Assemble the OpenAI message list for a chat turn.
+
+    `history` must already be bounded (a session deque or a pre-trimmed
+    list of role/content dicts). The live-data fetch is kicked off in the
+    background so it overlaps with prompt assembly instead of blocking
+    ahead of the OpenAI call. Returns (messages, enhanced_message).
+    """
+    # Prefer the background snapshot (zero I/O, pre-formatted); fall back to
+    # an overlapped fetch if the refresher isn't running or has gone stale
+    market_suffix = ''
+    market_future = None
+    if mentions_crypto(user_message):
+        if time.time() - MARKET_SNAPSHOT['ts'] < 2 * MARKET_REFRESH_INTERVAL:
+            market_suffix = MARKET_SNAPSHOT['suffix']
+        else:
+            market_future = MARKET_FETCH_POOL.submit(get_market_overview)
+
+    # Build conversation context
+    messages = [SYSTEM_MESSAGE]
+    messages.extend(history)
+
+    # Enhance message with live data if crypto-specific; a slow or down
+    # CoinGecko shouldn't fail the chat, so time out and answer without
+    # live data instead
+    if market_future:
+        try:
+            market_data = market_future.result(timeout=6)
+        except Exception as e:
+            logger.warning(f"Market data fetch timed out, answering without live data: {str(e)}")
+            market_data = None
+        if market_data:
+            market_suffix = _format_market_suffix(market_data)
+    enhanced_message = user_message + market_suffix if market_suffix else user_message
+
+    # Add current message
+    messages.append({"role": "user", "content": enhanced_message})
+    return messages, enhanced_message
+
+# SSE frames are coalesced so long answers don't pay a json.dumps + frame
+# per token-delta: flush when the buffer passes 256 bytes or 20 ms elapse.
+STREAM_FLUSH_BYTES = 256
+STREAM_FLUSH_SECONDS = 0.02
+
+def _sse_frame(payload):
+    if orjson is not None:
+        return b'data: ' + orjson.dumps(payload) + b'\n\n'
+    return b'data: ' + json.dumps(payload).encode() + b'\n\n'
+
+def stream_chat_response(messages, user_message=None, history=None):
+    """Yield SSE frames of coalesced completion deltas, then a final status frame.
+
+    When a session deque is passed as `history`, the user/assistant turn is
+    appended once the stream completes, so streamed turns accumulate the
+    same way /api/chat turns do.
+    """
+    try:
+        stream = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=messages,
+            max_tokens=1500,
+            temperature=0.7,
+            presence_penalty=0.1,
+            frequency_penalty=0.1,
+            stream=True
+        )
+
+        full_response = []
+        buffer = []
+        buffered_bytes = 0
+        last_flush = time.monotonic()
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            full_response.append(delta)
+            buffer.append(delta)
+            buffered_bytes += len(delta)
+            now = time.monotonic()
+            if buffered_bytes >= STREAM_FLUSH_BYTES or now - last_flush >= STREAM_FLUSH_SECONDS:
+                yield _sse_frame({'c': ''.join(buffer)})
+                buffer = []
+                buffered_bytes = 0
+                last_flush = now
+        if buffer:
+            yield _sse_frame({'c': ''.join(buffer)})
+
+        # Record the turn so the next request extends the deque in place
+        if history is not None and user_message:
+            history.append({"role": "user", "content": user_message})
+            history.append({"role": "assistant", "content": ''.join(full_response)})
+
+        # Status metadata goes in one final frame rather than on every delta
+        yield _sse_frame({
+            'done': True,
+            'success': True,
+            'model': OPENAI_MODEL,
+            'timestamp': now_iso()
+        })
+    except Exception as e:
+        logger.error(f"Stream error: {str(e)}")
+        yield _sse_frame({'error': f'An error occurred: {str(e)}', 'success': False})
+
+# index.html has no template variables, so there is no reason to run it
+# through Jinja per request. The bytes and their ETag are read once and
+# served with cache headers; repeat visits short-circuit to a 304.
+_index_page = None
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    global _index_page
+    if _index_page is None:
+        with open(os.path.join(app.root_path, 'templates', 'index.html'), 'rb') as f:
+            body = f.read()
+        _index_page = (body, hashlib.md5(body).hexdigest())
+
+    body, etag = _index_page
+    response = app.response_class(body, mimetype='text/html')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response.make_conditional(request)
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
@@ -110,53 +615,148 @@ def chat():
         # Check if API key is set
         if not os.getenv('OPENAI_API_KEY'):
             return jsonify({'error': 'API key not configured. Please set OPENAI_API_KEY environment variable.', 'success': False}), 500
-        
-        # Enhance message with live data if crypto-specific
-        enhanced_message = user_message
-        if any(crypto in user_message.lower() for crypto in ['bitcoin', 'btc', 'ethereum', 'eth', 'price', 'market']):
-            market_data = get_market_overview()
-            if market_data:
-                enhanced_message += f"\n\nLive Market Data: Total Market Cap: ${market_data.get('data', {}).get('total_market_cap', {}).get('usd', 0):,.0f}, 24h Vol: ${market_data.get('data', {}).get('total_volume', {}).get('usd', 0):,.0f}"
-        
-        # Build conversation context
-        messages = [{"role": "system", "content": CRYPTO_SYSTEM_PROMPT}]
-        
-        # Add conversation history (last 10 messages)
-        for msg in conversation_history[-10:]:
-            messages.append({"role": msg["role"], "content": msg["content"]})
-        
-        # Add current message
-        messages.append({"role": "user", "content": enhanced_message})
-        
-        # Make request to OpenAI API with latest model
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",  # Latest GPT-4 Turbo model
-            messages=messages,
-            max_tokens=1500,
-            temperature=0.7,
-            presence_penalty=0.1,
-            frequency_penalty=0.1
-        )
-        
-        ai_response = response.choices[0].message.content
-        
+
+        if len(user_message) > MAX_MESSAGE_CHARS:
+            return jsonify({'error': f'Message too long (max {MAX_MESSAGE_CHARS} characters)', 'success': False}), 400
+
+        session_id = data.get('session_id')
+        if session_id:
+            history = get_session_history(session_id)
+        else:
+            # Fall back to client-supplied history for older clients
+            history = [{"role": msg["role"], "content": msg["content"]}
+                       for msg in conversation_history[-MAX_HISTORY_MESSAGES:]]
+
+        # Route trivial and out-of-scope messages locally — no tokens, no
+        # latency. Short follow-ups in an ongoing conversation ("tell me
+        # more", "why?") look out-of-scope in isolation, so the scripted
+        # refusal only applies when there is no history giving them context.
+        route = classify_message(user_message)
+        if route == MSG_TRIVIAL or (route == MSG_OOS and not history):
+            return jsonify({
+                'response': random.choice(CRYPTO_GREETING_RESPONSES) if route == MSG_TRIVIAL else OOS_RESPONSE,
+                'success': True,
+                'model': 'local',
+                'timestamp': now_iso()
+            })
+
+        # Serve repeats from the response cache before touching OpenAI
+        cache_key = (normalize_question(user_message),
+                     history[-1]['content'] if history else None)
+        cached_response = response_cache_get(cache_key)
+        if cached_response is not None:
+            if session_id:
+                history.append({"role": "user", "content": user_message})
+                history.append({"role": "assistant", "content": cached_response})
+            return jsonify({
+                'response': cached_response,
+                'success': True,
+                'model': 'cache',
+                'timestamp': now_iso()
+            })
+
+        messages, enhanced_message = build_chat_messages(user_message, history)
+
+        model_used = OPENAI_MODEL
+        if len(messages) > 2:
+            # Ongoing conversations keep their own context and go out directly
+            response = client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                max_tokens=1500,
+                temperature=0.7,
+                presence_penalty=0.1,
+                frequency_penalty=0.1
+            )
+            ai_response = response.choices[0].message.content
+        elif len(user_message) // 4 < FAST_PATH_TOKEN_BUDGET:
+            # Short standalone questions don't need the flagship model
+            response = client.chat.completions.create(
+                model=FAST_MODEL,
+                messages=messages,
+                max_tokens=1500,
+                temperature=0.7,
+                presence_penalty=0.1,
+                frequency_penalty=0.1
+            )
+            ai_response = response.choices[0].message.content
+            model_used = FAST_MODEL
+        else:
+            # History-free questions can share a batched completion
+            ai_response = BATCHER.submit(enhanced_message).result(timeout=120)
+
+        response_cache_put(cache_key, ai_response)
+
+        # Record the turn so the next request extends the deque in place
+        if session_id:
+            history.append({"role": "user", "content": user_message})
+            history.append({"role": "assistant", "content": ai_response})
+
         return jsonify({
             'response': ai_response,
             'success': True,
-            'model': 'gpt-4-turbo-preview',
-            'timestamp': datetime.now().isoformat()
+            'model': model_used,
+            'timestamp': now_iso()
         })
         
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
         return jsonify({'error': f'An error occurred: {str(e)}', 'success': False}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming variant of /api/chat using server-sent events"""
+    try:
+        data = request.json
+        user_message = data.get('message', '')
+        conversation_history = data.get('history', [])
+
+        if not user_message:
+            return jsonify({'error': 'No message provided', 'success': False}), 400
+
+        if not os.getenv('OPENAI_API_KEY'):
+            return jsonify({'error': 'API key not configured. Please set OPENAI_API_KEY environment variable.', 'success': False}), 500
+
+        if len(user_message) > MAX_MESSAGE_CHARS:
+            return jsonify({'error': f'Message too long (max {MAX_MESSAGE_CHARS} characters)', 'success': False}), 400
+
+        session_id = data.get('session_id')
+        if session_id:
+            history = get_session_history(session_id)
+        else:
+            history = [{"role": msg["role"], "content": msg["content"]}
+                       for msg in conversation_history[-MAX_HISTORY_MESSAGES:]]
+
+        # Same guard as /api/chat: in-context follow-ups aren't out-of-scope
+        route = classify_message(user_message)
+        if route == MSG_TRIVIAL or (route == MSG_OOS and not history):
+            def local_frames():
+                yield _sse_frame({'c': random.choice(CRYPTO_GREETING_RESPONSES) if route == MSG_TRIVIAL else OOS_RESPONSE})
+                yield _sse_frame({'done': True, 'success': True, 'model': 'local',
+                                  'timestamp': now_iso()})
+            return app.response_class(local_frames(), mimetype='text/event-stream')
+
+        messages, _ = build_chat_messages(user_message, history)
+
+        return app.response_class(
+            stream_chat_response(messages, user_message=user_message,
+                                 history=history if session_id else None),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+
+    except Exception as e:
+        logger.error(f"Chat stream error: {str(e)}")
+        return jsonify({'error': f'An error occurred: {str(e)}', 'success': False}), 500
+
 @app.route('/api/market-data')
 def market_data():
     """Endpoint for live market data"""
     try:
         # Get top cryptocurrencies
-        url = f"{COINGECKO_API_BASE}/coins/markets"
         params = {
             "vs_currency": "usd",
             "order": "market_cap_desc",
@@ -164,24 +764,28 @@ def market_data():
             "page": 1,
             "sparkline": "false"
         }
-        response = requests.get(url, params=params, timeout=5)
-        data = response.json()
-        
-        return jsonify({
+        data = fetch_coingecko("/coins/markets", params)
+
+        return json_response({
             'success': True,
             'data': data,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now_iso()
         })
         
     except Exception as e:
         logger.error(f"Market data error: {str(e)}")
         return jsonify({'error': f'Failed to fetch market data: {str(e)}', 'success': False}), 500
 
+# CoinGecko ids are lowercase slugs; one anchored, length-bounded match
+# rejects junk before it ever reaches the upstream API
+_CRYPTO_ID_RE = re.compile(r'\A[A-Za-z0-9_-]{1,64}\Z')
+
 @app.route('/api/crypto/<crypto_id>')
 def crypto_detail(crypto_id):
     """Get detailed info for specific cryptocurrency"""
+    if not _CRYPTO_ID_RE.match(crypto_id):
+        return jsonify({'error': 'Invalid cryptocurrency id', 'success': False}), 400
     try:
-        url = f"{COINGECKO_API_BASE}/coins/{crypto_id}"
         params = {
             "localization": "false",
             "tickers": "false",
@@ -189,26 +793,74 @@ def crypto_detail(crypto_id):
             "community_data": "true",
             "developer_data": "true"
         }
-        response = requests.get(url, params=params, timeout=5)
-        data = response.json()
-        
-        return jsonify({
+        data = fetch_coingecko(f"/coins/{crypto_id}", params)
+
+        return json_response({
             'success': True,
             'data': data,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now_iso()
         })
         
     except Exception as e:
         logger.error(f"Crypto detail error: {str(e)}")
         return jsonify({'error': f'Failed to fetch crypto data: {str(e)}', 'success': False}), 500
 
+# Largest range the chart UI offers (_TIMEFRAMES); also caps the O(days)
+# mock-data fallback so a huge ?days= can't exhaust memory
+MAX_CHART_DAYS = 1825
+
+@app.route('/api/chart/<crypto_id>')
+def chart(crypto_id):
+    """Price/volume chart data for a cryptocurrency"""
+    if not _CRYPTO_ID_RE.match(crypto_id):
+        return jsonify({'error': 'Invalid cryptocurrency id', 'success': False}), 400
+
+    days = request.args.get('days', 365, type=int)
+    if not 1 <= days <= MAX_CHART_DAYS:
+        return jsonify({'error': f'days must be between 1 and {MAX_CHART_DAYS}', 'success': False}), 400
+    interval = request.args.get('interval', 'daily')
+
+    try:
+        result = chart_service.get_chart_data(crypto_id, days, interval)
+        if not result.get('success'):
+            # A coin CoinGecko doesn't know is a caller error, not an
+            # outage — don't fabricate a chart for it
+            if result.get('not_found'):
+                return jsonify({'error': result['error'], 'success': False}), 404
+            # Keep the UI alive with mock data when CoinGecko is down
+            logger.warning(f"Falling back to mock chart data: {result.get('error')}")
+            result = chart_service.get_mock_chart_data(crypto_id, days)
+
+        return json_response(result)
+
+    except Exception as e:
+        logger.error(f"Chart error: {str(e)}")
+        return jsonify({'error': f'Failed to build chart: {str(e)}', 'success': False}), 500
+
+# The options payload never changes at runtime, so serialize it once and
+# serve the cached bytes
+_chart_options_body = None
+
+@app.route('/api/chart-options')
+def chart_options():
+    """Cryptocurrencies and timeframes the chart UI can request"""
+    global _chart_options_body
+    if _chart_options_body is None:
+        payload = {
+            'success': True,
+            'cryptocurrencies': [dict(c) for c in chart_service.get_supported_cryptocurrencies()],
+            'timeframes': [dict(t) for t in chart_service.get_timeframe_options()]
+        }
+        _chart_options_body = orjson.dumps(payload) if orjson is not None else json.dumps(payload).encode()
+    return app.response_class(_chart_options_body, mimetype='application/json')
+
 @app.route('/health')
 def health():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'model': 'gpt-4-turbo-preview',
-        'timestamp': datetime.now().isoformat(),
+        'model': OPENAI_MODEL,
+        'timestamp': now_iso(),
         'version': '1.0.0'
     })
 
@@ -228,6 +880,8 @@ if __name__ == '__main__':
         print("export OPENAI_API_KEY='your_api_key_here'")
         print("or create a .env file with: OPENAI_API_KEY=your_api_key_here")
     
+    start_market_refresher()
+
     print("🚀 Starting Crypto Research Bot...")
     print("🤖 Powered by OpenAI GPT-4 Turbo")
     print("📈 Live crypto data integration enabled")
@@ -0,0 +1,478 @@
+# Chart service: historical price/volume charts from CoinGecko market_chart
+# data, rendered as Plotly figures for the web UI.
+
+import asyncio
+import copy
+import importlib.util
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from types import MappingProxyType
+
+import httpx
+import numpy as np
+import requests
+
+from config import now_iso
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# plotly + pandas cost ~200-400 ms of import time and ~40 MB RSS per
+# worker, paid at startup by users who never open a chart. Import them on
+# the first chart request instead.
+CHART_AVAILABLE = (importlib.util.find_spec('plotly') is not None
+                   and importlib.util.find_spec('pandas') is not None)
+
+go = None
+pio = None
+pd = None
+
+
+def _load_chart_libs():
+    """Import plotly/pandas once, on the first chart actually requested"""
+    global go, pio, pd
+    if go is None:
+        import pandas
+        import plotly.graph_objects
+        import plotly.io
+        pd = pandas
+        go = plotly.graph_objects
+        pio = plotly.io
+
+
+def _parse_json_body(response):
+    """Parse a response body with orjson when available.
+
+    orjson takes the raw bytes directly, skipping the intermediate str
+    that response.json() materializes — 2-3x faster on multi-year
+    market_chart payloads.
+    """
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+def _scatter_cls(n_points):
+    """WebGL scatter for dense series: the browser renders one vertex
+    buffer on the GPU instead of thousands of SVG DOM nodes"""
+    return go.Scattergl if n_points >= CHART_DOWNSAMPLE_TARGET else go.Scatter
+
+
+def _figure_to_dict(fig):
+    """Serialize a Plotly figure to a plain dict for the JSON response.
+
+    Uses plotly's orjson engine when available — substantially faster than
+    PlotlyJSONEncoder on numeric-heavy traces thanks to C-level numpy
+    handling.
+    """
+    if orjson is not None:
+        return orjson.loads(pio.to_json(fig, validate=False, engine='orjson'))
+    return json.loads(pio.to_json(fig, validate=False))
+
+COINGECKO_API_BASE = "https://api.coingecko.com/api/v3"
+
+# A ~300px-high chart can't resolve more than a few hundred points, so
+# long series are strided down before the figure is built — smaller JSON
+# payload and less browser-side rendering for no visible quality loss.
+CHART_DOWNSAMPLE_TARGET = 500
+
+# Rough current prices used to seed mock chart data per coin
+_MOCK_BASE_PRICES = {
+    'bitcoin': 43000,
+    'ethereum': 2300,
+    'solana': 98,
+    'cardano': 0.52,
+    'ripple': 0.61,
+    'dogecoin': 0.082,
+    'polkadot': 7.1,
+    'chainlink': 14.5,
+    'litecoin': 72,
+    'binancecoin': 310
+}
+
+# Shared figure styling: the live and mock chart paths draw identical
+# traces and layout, so the kwargs dicts are built once at import instead
+# of from scratch on every chart. update_layout/add_trace copy values in,
+# so reuse across figures is safe.
+# fill='tozeroy' states the intent explicitly: with no preceding trace,
+# 'tonexty' silently fell back to filling to y=0 anyway
+_PRICE_TRACE_KW = dict(
+    name='Price (USD)',
+    mode='lines',
+    line=dict(color='#667eea', width=2),
+    fill='tozeroy',
+    fillcolor='rgba(102, 126, 234, 0.1)'
+)
+
+_VOL_TRACE_KW = dict(
+    name='Volume',
+    yaxis='y2',
+    opacity=0.3
+)
+
+_CHART_LAYOUT = dict(
+    template='plotly_white',
+    hovermode='x unified',
+    showlegend=False,
+    margin=dict(l=50, r=50, t=30, b=40),
+    xaxis=dict(
+        showgrid=False,
+        rangeslider=dict(visible=False)
+    ),
+    yaxis=dict(
+        title='Price (USD)',
+        showgrid=True,
+        gridcolor='rgba(0, 0, 0, 0.05)',
+        tickprefix='$'
+    ),
+    yaxis2=dict(
+        title='Volume',
+        overlaying='y',
+        side='right',
+        showgrid=False
+    ),
+    plot_bgcolor='white',
+    paper_bgcolor='white',
+    font=dict(family='Segoe UI, sans-serif', size=12)
+)
+
+
+class ChartService:
+    """Builds Plotly price/volume charts from CoinGecko market_chart data.
+
+    Meant to be instantiated once and shared across requests: the instance
+    owns a pooled requests.Session so CoinGecko calls reuse keep-alive
+    sockets instead of paying a TCP+TLS handshake each time.
+    """
+
+    def __init__(self, api_timeout=10, min_request_interval=1.2, cache_ttl=60.0):
+        self.api_timeout = api_timeout
+        self.min_request_interval = min_request_interval
+        self.last_request_time = 0.0
+        self._rl_lock = threading.Lock()
+
+        # A chart series barely changes minute-to-minute, so repeats of the
+        # same (crypto_id, days, interval) within the TTL skip the network
+        # and the rate-limit sleep entirely. Oldest-inserted entries are
+        # evicted past 128 to bound memory.
+        self._cache = OrderedDict()
+        self._cache_ttl = cache_ttl
+        self._cache_max_entries = 128
+        self._cache_lock = threading.Lock()
+
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            # urllib3 owns all retrying, including 429s: it honors
+            # CoinGecko's Retry-After cooldown instead of a hardcoded
+            # sleep, with exponential backoff for gateway errors
+            max_retries=Retry(
+                total=3,
+                backoff_factor=1.0,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=['GET'],
+                respect_retry_after_header=True
+            )
+        ))
+        self._session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip',
+            'User-Agent': 'crypto-bot/1.0'
+        })
+
+        # Async client for multi-coin fan-out, created lazily so purely
+        # sync callers never pay for it. The semaphore keeps concurrent
+        # fetches inside CoinGecko's free-tier tolerance.
+        self._aclient = None
+        self._async_sem = asyncio.Semaphore(5)
+
+    def _rate_limit(self):
+        """Space out CoinGecko calls to stay inside the free-tier limit.
+
+        Uses the monotonic clock (immune to NTP jumps) and sleeps under a
+        lock, deliberately serializing concurrent Flask threads so two
+        callers can't clear the gate at once. Only runs on cache misses —
+        the cache check in get_chart_data comes first.
+        """
+        with self._rl_lock:
+            elapsed = time.monotonic() - self.last_request_time
+            if elapsed < self.min_request_interval:
+                time.sleep(self.min_request_interval - elapsed)
+            self.last_request_time = time.monotonic()
+
+    def get_chart_data(self, crypto_id='bitcoin', days=365, interval='daily'):
+        """Fetch market_chart data and build a chart payload for the UI"""
+        if not CHART_AVAILABLE:
+            return {'success': False, 'error': 'Charting libraries not installed'}
+
+        cache_key = (crypto_id, days, interval)
+        with self._cache_lock:
+            entry = self._cache.get(cache_key)
+            if entry and time.time() - entry[0] < self._cache_ttl:
+                # Deep copy so callers can't mutate the cached figure
+                return copy.deepcopy(entry[1])
+
+        try:
+            self._rate_limit()
+            url = f"{COINGECKO_API_BASE}/coins/{crypto_id}/market_chart"
+            params = {'vs_currency': 'usd', 'days': days}
+            if interval:
+                params['interval'] = interval
+            try:
+                response = self._session.get(url, params=params, timeout=self.api_timeout)
+            except requests.exceptions.RetryError:
+                return {'success': False, 'error': 'CoinGecko rate limit exceeded, try again shortly'}
+
+            if response.status_code == 404:
+                # not_found lets callers distinguish a bad id from a
+                # transient upstream failure
+                return {'success': False, 'not_found': True,
+                        'error': f'Unknown cryptocurrency: {crypto_id}'}
+            if response.status_code != 200:
+                # Slice the raw bytes first: .text would decode the whole
+                # (potentially huge) error body just to show a snippet
+                body = response.content[:200].decode('utf-8', 'replace') if response.content else ''
+                return {'success': False, 'error': f'API error: {response.status_code} - {body}'}
+
+            data = _parse_json_body(response)
+            result = self._parse_chart_response(crypto_id, days, data)
+            if result['success']:
+                self._cache_store(cache_key, result)
+            return result
+
+        except Exception as e:
+            logger.error(f"Chart data error: {str(e)}")
+            return {'success': False, 'error': f'Failed to fetch chart data: {str(e)}'}
+
+    def _parse_chart_response(self, crypto_id, days, data):
+        """Turn a market_chart payload into the chart result dict"""
+        prices = data.get('prices', [])
+        volumes = data.get('total_volumes', [])
+        if not prices:
+            return {'success': False, 'error': 'No price data returned'}
+
+        chart = self._create_chart(prices, volumes)
+
+        volume_arr = np.asarray(volumes, dtype=np.float64)
+        first_price = prices[0][1]
+        current_price = prices[-1][1]
+        price_change = ((current_price - first_price) / first_price) * 100 if first_price else 0
+
+        return {
+            'success': True,
+            'crypto_id': crypto_id,
+            'days': days,
+            'chart': chart,
+            'current_price': current_price,
+            'price_change_percent': price_change,
+            'latest_volume': float(volume_arr[-1, 1]) if volume_arr.size else 0,
+            'timestamp': now_iso()
+        }
+
+    def _cache_store(self, cache_key, result):
+        with self._cache_lock:
+            if cache_key not in self._cache and len(self._cache) >= self._cache_max_entries:
+                self._cache.popitem(last=False)
+            self._cache[cache_key] = (time.time(), result)
+
+    def _get_async_client(self):
+        if self._aclient is None:
+            self._aclient = httpx.AsyncClient(
+                base_url=COINGECKO_API_BASE,
+                timeout=self.api_timeout,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                headers=dict(self._session.headers)
+            )
+        return self._aclient
+
+    async def aget_chart_data(self, crypto_id='bitcoin', days=365, interval='daily'):
+        """Async variant of get_chart_data sharing the same cache and parsing"""
+        if not CHART_AVAILABLE:
+            return {'success': False, 'error': 'Charting libraries not installed'}
+
+        cache_key = (crypto_id, days, interval)
+        with self._cache_lock:
+            entry = self._cache.get(cache_key)
+            if entry and time.time() - entry[0] < self._cache_ttl:
+                return copy.deepcopy(entry[1])
+
+        try:
+            params = {'vs_currency': 'usd', 'days': days}
+            if interval:
+                params['interval'] = interval
+            async with self._async_sem:
+                response = await self._get_async_client().get(
+                    f"/coins/{crypto_id}/market_chart", params=params)
+
+            if response.status_code == 404:
+                # not_found lets callers distinguish a bad id from a
+                # transient upstream failure
+                return {'success': False, 'not_found': True,
+                        'error': f'Unknown cryptocurrency: {crypto_id}'}
+            if response.status_code != 200:
+                # Slice the raw bytes first: .text would decode the whole
+                # (potentially huge) error body just to show a snippet
+                body = response.content[:200].decode('utf-8', 'replace') if response.content else ''
+                return {'success': False, 'error': f'API error: {response.status_code} - {body}'}
+
+            result = self._parse_chart_response(crypto_id, days, _parse_json_body(response))
+            if result['success']:
+                self._cache_store(cache_key, result)
+            return result
+
+        except Exception as e:
+            logger.error(f"Chart data error: {str(e)}")
+            return {'success': False, 'error': f'Failed to fetch chart data: {str(e)}'}
+
+    async def aget_charts(self, crypto_ids, days=365, interval='daily'):
+        """Fetch charts for several coins concurrently; returns id -> result"""
+        results = await asyncio.gather(
+            *(self.aget_chart_data(crypto_id, days, interval) for crypto_id in crypto_ids))
+        return dict(zip(crypto_ids, results))
+
+    def _create_chart(self, prices, volumes):
+        """Build the Plotly figure dict from raw [timestamp, value] pairs"""
+        _load_chart_libs()
+        # Column-slice the [ts, value] pairs in C instead of iterating the
+        # nested lists in Python. The traces take the numpy arrays directly
+        # — no DataFrame, Series, or index allocation on the way.
+        price_arr = np.asarray(prices, dtype=np.float64)
+        vol_arr = np.asarray(volumes, dtype=np.float64)
+
+        if len(price_arr) > CHART_DOWNSAMPLE_TARGET:
+            idx = self._downsample_idx(len(price_arr))
+            price_arr = price_arr[idx]
+            if vol_arr.size:
+                vol_arr = vol_arr[idx]
+
+        dates = pd.to_datetime(price_arr[:, 0].astype('int64'), unit='ms')
+        price = price_arr[:, 1]
+        volume = vol_arr[:, 1] if vol_arr.size else np.zeros_like(price)
+
+        fig = go.Figure()
+        fig.add_trace(_scatter_cls(len(price))(x=dates, y=price, **_PRICE_TRACE_KW))
+        fig.add_trace(go.Bar(
+            x=dates,
+            y=volume,
+            marker=dict(color=self._get_volume_colors(price)),
+            **_VOL_TRACE_KW
+        ))
+        fig.update_layout(**_CHART_LAYOUT)
+
+        return _figure_to_dict(fig)
+
+    @staticmethod
+    def _downsample_idx(n, target=CHART_DOWNSAMPLE_TARGET):
+        """Evenly-strided indices down to target points, endpoints kept"""
+        return np.linspace(0, n - 1, target).astype(int)
+
+    def _get_volume_colors(self, prices):
+        """Color volume bars green on up-days and red on down-days.
+
+        Vectorized over the price array: one shifted comparison and one
+        np.where instead of per-row pandas scalar lookups.
+        """
+        p = np.asarray(prices, dtype=np.float64)
+        up = np.empty(len(p), dtype=bool)
+        if p.size:
+            up[0] = True
+            up[1:] = p[1:] >= p[:-1]
+        return np.where(up, '#2ca02c', '#d62728').tolist()
+
+    def get_mock_chart_data(self, crypto_id='bitcoin', days=365):
+        """Generate a plausible-looking chart when CoinGecko is unavailable"""
+        if not CHART_AVAILABLE:
+            return {'success': False, 'error': 'Charting libraries not installed'}
+        _load_chart_libs()
+
+        n_days = int(days)
+        if n_days < 1:
+            return {'success': False, 'error': 'days must be a positive integer'}
+
+        base_price = _MOCK_BASE_PRICES.get(crypto_id, 100)
+        end = datetime.now()
+        dates = [end - timedelta(days=n_days - 1 - i) for i in range(n_days)]
+
+        # Geometric random walk with a slight upward drift: one RNG draw
+        # plus cumsum/exp. Staying in log space keeps prices positive, so
+        # no clipping pass or intermediate trend/noise/seasonal arrays.
+        rng = np.random.default_rng(42)
+        log_returns = rng.normal(0.15 / n_days, 0.02, n_days)
+        prices = base_price * np.exp(np.cumsum(log_returns))
+
+        volumes = base_price * 1e4 * rng.lognormal(1.0, 0.5, n_days)
+
+        if n_days > CHART_DOWNSAMPLE_TARGET:
+            idx = self._downsample_idx(n_days)
+            dates = [dates[i] for i in idx]
+            prices = prices[idx]
+            volumes = volumes[idx]
+
+        colors = self._get_volume_colors(prices)
+
+        fig = go.Figure()
+        fig.add_trace(_scatter_cls(len(prices))(x=dates, y=prices, **_PRICE_TRACE_KW))
+        fig.add_trace(go.Bar(
+            x=dates,
+            y=volumes,
+            marker=dict(color=colors),
+            **_VOL_TRACE_KW
+        ))
+        fig.update_layout(**_CHART_LAYOUT)
+
+        return {
+            'success': True,
+            'crypto_id': crypto_id,
+            'days': days,
+            'chart': _figure_to_dict(fig),
+            'current_price': float(prices[-1]),
+            'price_change_percent': float((prices[-1] - prices[0]) / prices[0] * 100),
+            'latest_volume': float(volumes[-1]),
+            'mock': True,
+            'timestamp': now_iso()
+        }
+
+    def get_supported_cryptocurrencies(self):
+        """Cryptocurrencies the chart UI offers (shared read-only views)"""
+        return _SUPPORTED_CRYPTOS
+
+    def get_timeframe_options(self):
+        """Timeframes the chart UI offers (shared read-only views)"""
+        return _TIMEFRAMES
+
+
+# These sit on a hot UI endpoint, so hand out one shared tuple of read-only
+# mapping views instead of allocating fresh list-of-dicts per call; callers
+# can't mutate the shared state.
+_SUPPORTED_CRYPTOS = tuple(MappingProxyType(d) for d in [
+    {'id': 'bitcoin', 'symbol': 'BTC', 'name': 'Bitcoin'},
+    {'id': 'ethereum', 'symbol': 'ETH', 'name': 'Ethereum'},
+    {'id': 'binancecoin', 'symbol': 'BNB', 'name': 'BNB'},
+    {'id': 'solana', 'symbol': 'SOL', 'name': 'Solana'},
+    {'id': 'ripple', 'symbol': 'XRP', 'name': 'XRP'},
+    {'id': 'cardano', 'symbol': 'ADA', 'name': 'Cardano'},
+    {'id': 'dogecoin', 'symbol': 'DOGE', 'name': 'Dogecoin'},
+    {'id': 'polkadot', 'symbol': 'DOT', 'name': 'Polkadot'},
+    {'id': 'chainlink', 'symbol': 'LINK', 'name': 'Chainlink'},
+    {'id': 'litecoin', 'symbol': 'LTC', 'name': 'Litecoin'}
+])
+
+_TIMEFRAMES = tuple(MappingProxyType(d) for d in [
+    {'days': 1, 'label': '24H', 'interval': 'hourly'},
+    {'days': 7, 'label': '7D', 'interval': 'hourly'},
+    {'days': 30, 'label': '1M', 'interval': 'daily'},
+    {'days': 90, 'label': '3M', 'interval': 'daily'},
+    {'days': 365, 'label': '1Y', 'interval': 'daily'},
+    {'days': 1825, 'label': '5Y', 'interval': 'daily'}
+])
@@ -0,0 +1,70 @@
+# Shared message-classification configuration: greeting patterns, crypto
+# vocabulary, and canned responses. Regexes are compiled once here at
+# import time so callers do a single C-level match per message instead of
+# iterating pattern lists on the request path.
+
+import re
+import time
+from datetime import datetime
+
+GREETING_PATTERNS = [
+    r'hi+',
+    r'hey+',
+    r'hello+',
+    r'yo',
+    r'sup',
+    r'howdy',
+    r'good\s+(morning|afternoon|evening)',
+    r'what\'?s\s+up',
+    r'greetings',
+]
+
+GREETING_RE = re.compile(
+    r'^(?:' + '|'.join(f'(?:{p})' for p in GREETING_PATTERNS) + r')[!.?\s]*$',
+    re.IGNORECASE
+)
+
+CRYPTO_GREETING_RESPONSES = [
+    "Hey! I'm CryptoBot, your crypto research assistant. Ask me about any coin, market trends, DeFi, NFTs, or trading strategies!",
+    "Hello! Ready to dive into crypto? Ask me about prices, market analysis, or any blockchain topic.",
+    "Hi there! I'm here to help with cryptocurrency research. What would you like to know about the markets today?",
+]
+
+# Keywords that flag a message as wanting live market data
+CRYPTO_KEYWORDS = (
+    'bitcoin', 'btc', 'ethereum', 'eth', 'price', 'market',
+)
+
+CRYPTO_KEYWORD_RE = re.compile('|'.join(re.escape(k) for k in CRYPTO_KEYWORDS))
+CRYPTO_KEYWORDS_SET = frozenset(CRYPTO_KEYWORDS)
+
+# Broader vocabulary used only for scope routing — a message matching none
+# of these is answered with a scripted reply instead of a model call
+CRYPTO_SCOPE_KEYWORDS = CRYPTO_KEYWORDS + (
+    'crypto', 'coin', 'token', 'blockchain', 'defi', 'nft', 'wallet',
+    'staking', 'stake', 'mining', 'miner', 'exchange', 'trading', 'trade',
+    'altcoin', 'stablecoin', 'web3', 'dapp', 'dex', 'yield', 'airdrop',
+    'halving', 'ledger', 'satoshi', 'solana', 'sol', 'cardano', 'ada',
+    'ripple', 'xrp', 'dogecoin', 'doge', 'binance', 'bull', 'bear',
+    'hodl', 'portfolio', 'invest', 'chart', 'candle', 'liquidity', 'gas',
+)
+
+CRYPTO_SCOPE_RE = re.compile('|'.join(re.escape(k) for k in CRYPTO_SCOPE_KEYWORDS))
+
+OOS_RESPONSE = (
+    "I'm a cryptocurrency research assistant, so I can only help with "
+    "crypto, blockchain, DeFi, NFT, and market questions. Try asking me "
+    "about a coin, a protocol, or market trends!"
+)
+
+# Response timestamps only need second resolution, so format at most once
+# per second instead of paying datetime.now().isoformat() per response.
+_ts_cache = [0, '']
+
+def now_iso():
+    """Current local time as an ISO string, cached at 1s granularity"""
+    t = int(time.time())
+    if t != _ts_cache[0]:
+        _ts_cache[0] = t
+        _ts_cache[1] = datetime.fromtimestamp(t).isoformat()
+    return _ts_cache[1]
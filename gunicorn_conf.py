@@ -0,0 +1,23 @@
+# Gunicorn configuration for production deployment
+# The app is almost entirely I/O-bound (CoinGecko + OpenAI sockets), so
+# threaded workers let a few processes serve many concurrent connections
+# instead of sync workers sitting blocked one request at a time.
+
+import os
+
+workers = (2 * (os.cpu_count() or 1)) + 1
+worker_class = 'gthread'
+threads = 16
+
+# Long keepalive for clients polling market data; generous timeout so
+# slow OpenAI completions aren't killed mid-response
+keepalive = 30
+timeout = 120
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+
+def post_fork(server, worker):
+    # Threads don't survive fork, so each worker starts its own
+    # market-snapshot refresher
+    from app import start_market_refresher
+    start_market_refresher()